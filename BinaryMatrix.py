@@ -1,4 +1,82 @@
-import copy
+import numpy as np
+
+def gf2_rank(rows, cols, floor=0):
+    """
+    This function computes the rank over GF(2) of a binary matrix stored as one integer per row, column 0 being the
+    most significant of the cols bits. Row operations are XORs of whole rows and only the forward elimination is done,
+    the backward pass does not change the rank.
+    :param rows: the rows of the matrix as integers
+    :param cols: the number of columns
+    :param floor: stop as soon as the rank is known to be below this value
+    :return: the rank of the matrix, or an upper bound of it that is below floor when the elimination stopped early
+    """
+    rows = list(rows)
+    num_rows = len(rows)
+    rank = 0
+    for col in range(cols):
+        bit = 1 << (cols - 1 - col)
+        # Look for a pivot in the rows that are not yet part of the echelon form
+        pivot = rank
+        while pivot < num_rows and not rows[pivot] & bit:
+            pivot += 1
+        if pivot == num_rows:
+            # Every remaining column can add at most one to the rank
+            if rank + min(cols - col - 1, num_rows - rank) < floor:
+                return rank + min(cols - col - 1, num_rows - rank)
+            continue
+        rows[rank], rows[pivot] = rows[pivot], rows[rank]
+        for i in range(rank + 1, num_rows):
+            if rows[i] & bit:
+                rows[i] ^= rows[rank]
+        rank += 1
+        if rank == num_rows:
+            break
+    return rank
+
+def batch_gf2_rank(rows, cols, floor=0):
+    """
+    This function computes the GF(2) ranks of a whole batch of binary matrices at once. Each step of the elimination
+    handles one column in every matrix of the batch with array operations: the first row not yet used as a pivot
+    that has the column bit set becomes the pivot and is XORed into the other unused rows with that bit.
+    :param rows: a (num_matrices, num_rows) array of unsigned integer rows, column 0 being the most significant of
+    the cols bits (cols <= 64)
+    :param cols: the number of columns
+    :param floor: drop a matrix from the elimination as soon as its rank is known to be below this value, as in
+    gf2_rank
+    :return: an array with the rank of every matrix, or an upper bound of it that is below floor for the dropped ones
+    """
+    rows = np.array(rows, dtype=np.uint64)
+    num, num_rows = rows.shape
+    ranks = np.zeros(num, dtype=np.int64)
+    # The matrices still being eliminated: their index in the batch, rows, unused rows and rank so far
+    active = np.arange(num)
+    unused = np.ones((num, num_rows), dtype=bool)
+    rank = np.zeros(num, dtype=np.int64)
+    for col in range(cols):
+        if floor:
+            # Every remaining column can add at most one to the rank
+            bound = rank + np.minimum(cols - col, num_rows - rank)
+            done = bound < floor
+            if done.any():
+                ranks[active[done]] = bound[done]
+                keep = ~done
+                active, rows, unused, rank = active[keep], rows[keep], unused[keep], rank[keep]
+                if not len(active):
+                    break
+        index = np.arange(len(active))
+        bit = np.uint64(1 << (cols - 1 - col))
+        candidates = ((rows & bit) != 0) & unused
+        found = candidates.any(axis=1)
+        pivot = candidates.argmax(axis=1)
+        pivot_row = rows[index, pivot]
+        candidates[index, pivot] = False
+        candidates &= found[:, None]
+        rows ^= np.where(candidates, pivot_row[:, None], np.uint64(0))
+        unused[index[found], pivot[found]] = False
+        rank += found
+    ranks[active] = rank
+    return ranks
+
 
 class BinaryMatrix:
     def __init__(self, matrix, rows, cols):
@@ -14,110 +92,26 @@ class BinaryMatrix:
         self.A = matrix
         self.m = min(rows, cols)
 
-    def compute_rank(self, verbose=False):
+    def pack_rows(self):
         """
-        This method computes the binary rank of self.matrix
-        :param verbose: if this is true it prints out the matrix after the forward elimination and backward elimination
-        operations on the rows. This was used to testing the method to check it is working as expected.
-        :return: the rank of the matrix.
+        This method packs every row of self.A into one integer, the first column being the most significant bit.
+        :return: the list of packed rows
         """
-        if verbose:
-            print("Original Matrix\n", self.A)
-
-        i = 0
-        while i < self.m - 1:
-            if self.A[i][i] == 1:
-                self.perform_row_operations(i, True)
-            else:
-                found = self.find_unit_element_swap(i, True)
-                if found == 1:
-                    self.perform_row_operations(i, True)
-            i += 1
-
-        if verbose:
-            print("Intermediate Matrix\n", self.A)
-
-        i = self.m - 1
-        while i > 0:
-            if self.A[i][i] == 1:
-                self.perform_row_operations(i, False)
-            else:
-                if self.find_unit_element_swap(i, False) == 1:
-                    self.perform_row_operations(i, False)
-            i -= 1
-
-        if verbose:
-            print("Final Matrix\n", self.A)
-
-        return self.determine_rank()
+        packed = np.packbits(np.asarray(self.A, dtype=np.uint8).reshape(self.M, self.Q), axis=1)
+        shift = 8 * packed.shape[1] - self.Q
+        return [int.from_bytes(row.tobytes(), 'big') >> shift for row in packed]
 
-    def perform_row_operations(self, i, forward_elimination):
+    def compute_rank(self, verbose=False, floor=0):
         """
-        This method performs the elementary row operations. This involves xor'ing up to two rows together depending on
-        whether or not certain elements in the matrix contain 1's if the "current" element does not.
-        :param i: the current index we are are looking at
-        :param forward_elimination: True or False.
+        This method computes the binary rank of self.matrix with the bit-packed elimination of gf2_rank
+        :param verbose: if this is true it prints out the matrix and its packed rows. This was used to testing the
+        method to check it is working as expected.
+        :param floor: stop as soon as the rank is known to be below this value, e.g. self.m - 1 when only full rank,
+        full rank - 1 and lower have to be told apart
+        :return: the rank of the matrix (or a value below floor).
         """
-        if forward_elimination:
-            j = i + 1
-            while j < self.M:
-                if self.A[j][i] == 1:
-                    self.A[j, :] = (self.A[j, :] + self.A[i, :]) % 2
-                j += 1
-        else:
-            j = i - 1
-            while j >= 0:
-                if self.A[j][i] == 1:
-                    self.A[j, :] = (self.A[j, :] + self.A[i, :]) % 2
-                j -= 1
-
-    def find_unit_element_swap(self, i, forward_elimination):
-        """
-        This given an index which does not contain a 1 this searches through the rows below the index to see which rows
-        contain 1's, if they do then they swapped. This is done on the forward and backward elimination
-        :param i: the current index we are looking at
-        :param forward_elimination: True or False.
-        """
-        row_op = 0
-        if forward_elimination:
-            index = i + 1
-            while index < self.M and self.A[index][i] == 0:
-                index += 1
-            if index < self.M:
-                row_op = self.swap_rows(i, index)
-        else:
-            index = i - 1
-            while index >= 0 and self.A[index][i] == 0:
-                index -= 1
-            if index >= 0:
-                row_op = self.swap_rows(i, index)
-        return row_op
-
-    def swap_rows(self, i, ix):
-        """
-        This method just swaps two rows in a matrix. Had to use the copy package to ensure no memory leakage
-        :param i: the first row we want to swap and
-        :param ix: the row we want to swap it with
-        :return: 1
-        """
-        temp = copy.copy(self.A[i, :])
-        self.A[i, :] = self.A[ix, :]
-        self.A[ix, :] = temp
-        return 1
-
-    def determine_rank(self):
-        """
-        This method determines the rank of the transformed matrix
-        :return: the rank of the transformed matrix
-        """
-        rank = self.m
-        i = 0
-        while i < self.M:
-            all_zeros = 1
-            for j in range(self.Q):
-                if self.A[i][j] == 1:
-                    all_zeros = 0
-            if all_zeros == 1:
-                rank -= 1
-            i += 1
-        return rank
+        rows = self.pack_rows()
+        if verbose:
+            print("Original Matrix\n", self.A)
+            print("Packed Rows\n", "\n".join(format(row, "0{}b".format(self.Q)) for row in rows))
+        return gf2_rank(rows, self.Q, floor)
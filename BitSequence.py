@@ -0,0 +1,237 @@
+import numpy as np
+
+# The number of ones in every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def rolling_codes(bits, m, out):
+    """
+    Writes the codes of the first len(out) m-bit windows of bits into out, one shift and OR per bit of the window.
+    """
+    out[:] = 0
+    for k in range(m):
+        out <<= 1
+        out |= bits[k:k + len(out)]
+
+class BitSequence:
+    def __init__(self, packed, n=None):
+        """
+        A binary sequence stored packed, eight bits per byte, most significant bit first (the order of np.packbits and
+        of the 'bits' format of KeystreamWriter). This takes 1/8 of a byte per bit where a binary string takes one byte
+        per bit.
+        :param packed: the packed bits, a uint8 array or a bytes-like object
+        :param n: the number of bits in the sequence, by default every bit of packed
+        :return: a BitSequence object
+        """
+        self.packed = np.frombuffer(packed, dtype=np.uint8) if not isinstance(packed, np.ndarray) else packed
+        self.n = 8 * len(self.packed) if n is None else n
+        self._bits = None
+        # The analysis context: artifacts the tests share, computed the first time one of them asks for it
+        self._cache = {}
+
+    @classmethod
+    def from_bits(cls, bits):
+        """
+        :param bits: an array-like of 0/1 values, one per bit
+        :return: the packed BitSequence
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        return cls(np.packbits(bits), len(bits))
+
+    @classmethod
+    def from_str(cls, bin_data: str):
+        """
+        :param bin_data: a binary string of '0' and '1' characters
+        :return: the packed BitSequence
+        """
+        return cls.from_bits(np.frombuffer(bin_data.encode('ascii'), dtype=np.uint8) - ord('0'))
+
+    @classmethod
+    def from_file(cls, path, fmt='bin'):
+        """
+        :param path: the file to read
+        :param fmt: 'bin' for packed binary data, 'ascii' for '0'/'1' characters (any other character is skipped)
+        :return: the BitSequence stored in the file
+        """
+        raw = np.fromfile(path, dtype=np.uint8)
+        if fmt == 'bin':
+            return cls(raw)
+        return cls.from_bits(raw[(raw == ord('0')) | (raw == ord('1'))] - ord('0'))
+
+    @classmethod
+    def coerce(cls, data):
+        """
+        Turns anything the NistTest methods accept into a BitSequence.
+        :param data: a BitSequence, a binary string, packed bytes or an array of 0/1 values
+        :return: the BitSequence
+        """
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, str):
+            return cls.from_str(data)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return cls(data)
+        return cls.from_bits(data)
+
+    def __len__(self):
+        return self.n
+
+    def __str__(self):
+        return (self.bits + ord('0')).tobytes().decode('ascii')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return BitSequence.from_bits(self.bits[index])
+        return int(self.bits[index])
+
+    @property
+    def bits(self):
+        """
+        The sequence as a uint8 array of 0/1 values, unpacked once and then shared (read-only) by every view.
+        """
+        if self._bits is None:
+            self._bits = np.unpackbits(self.packed, count=self.n)
+            self._bits.flags.writeable = False
+        return self._bits
+
+    def unpack(self, start=0, stop=None):
+        """
+        Unpacks only the bits start .. stop-1, unless the whole sequence is unpacked already.
+        :return: a uint8 array of 0/1 values
+        """
+        stop = self.n if stop is None else min(stop, self.n)
+        if self._bits is not None:
+            return self._bits[start:stop]
+        first = start // 8
+        return np.unpackbits(self.packed[first:-(-stop // 8)])[start - 8 * first:stop - 8 * first]
+
+    def _cached(self, key, compute):
+        """
+        Returns the artifact stored under key, computing (and storing) it on the first call.
+        """
+        if key not in self._cache:
+            value = compute()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._cache[key] = value
+        return self._cache[key]
+
+    def clear_cache(self):
+        """
+        Drops every cached artifact and the unpacked bits, leaving only the packed sequence. Anything a test needs
+        afterwards is computed again. Using the BitSequence in a with block calls this at the end of the block.
+        """
+        self._cache.clear()
+        self._bits = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.clear_cache()
+
+    @property
+    def pm_one(self):
+        """
+        The sequence as an int8 array of -1/+1 values.
+        """
+        return 2 * self.bits.astype(np.int8) - 1
+
+    @property
+    def prefix_sums(self):
+        """
+        The random walk of the -1/+1 sequence: element i is the sum of the first i + 1 steps (cached, read-only).
+        """
+        return self._cached('prefix_sums', self._prefix_sums)
+
+    def _prefix_sums(self):
+        # The walk after i + 1 steps is 2 * (ones so far) - (i + 1), worked out in place on the ones count
+        dtype = np.int32 if self.n < 2 ** 31 else np.int64
+        sums = np.cumsum(self.bits, dtype=dtype)
+        sums <<= 1
+        sums -= np.arange(1, self.n + 1, dtype=dtype)
+        return sums
+
+    @property
+    def zero_crossings(self):
+        """
+        The indices i at which the random walk is back at zero, prefix_sums[i] == 0 (cached, read-only).
+        """
+        return self._cached('zero_crossings', lambda: np.flatnonzero(self.prefix_sums == 0))
+
+    def count_ones(self):
+        """
+        Counts the ones on the packed bytes with a popcount table, without unpacking the sequence.
+        :return: the number of ones in the sequence (cached)
+        """
+        return self._cached('ones', self._count_ones)
+
+    def _count_ones(self):
+        full = self.n // 8
+        ones = int(POPCOUNT[self.packed[:full]].sum(dtype=np.int64))
+        if self.n % 8:
+            ones += int(np.unpackbits(self.packed[full:full + 1])[:self.n % 8].sum())
+        return ones
+
+    def words(self, width):
+        """
+        :param width: the number of bits per word, at most 64
+        :return: a uint64 array with consecutive width-bit blocks as unsigned integers, first bit most significant,
+        the remainder is discarded
+        """
+        count = self.n // width
+        if width in (8, 16, 32, 64):
+            # Byte aligned, read straight from the packed bytes
+            return self.packed[:count * width // 8].view('>u{}'.format(width // 8)).astype(np.uint64)
+        packed = np.zeros((count, 8), dtype=np.uint8)
+        block_bytes = -(-width // 8)
+        packed[:, :block_bytes] = np.packbits(self.blocks(width), axis=1)
+        return packed.view('>u8')[:, 0].astype(np.uint64) >> np.uint64(64 - width)
+
+    def window_codes(self, m, wrap=False):
+        """
+        Computes the code of every m-bit window in one pass per bit of the window, first bit most significant. The
+        codes of the last m asked for are kept; the windows that wrap around are only worked out once they are asked
+        for and are stored after the others.
+        :param m: the window length, at most 32
+        :param wrap: if this is true the windows wrap around to the start of the sequence, giving one window per bit
+        :return: a uint32 array with the code of the window starting at every position (read-only)
+        """
+        count = min(max(self.n - m + 1, 0), self.n)
+        cached = self._cache.get('window_codes')
+        if cached is None or cached[0] != m:
+            # Only the codes of one m are kept, they take 4 bytes per bit
+            cached = self._cache['window_codes'] = [m, np.empty(self.n, dtype=np.uint32), False]
+            rolling_codes(self.bits, m, cached[1][:count])
+        codes = cached[1]
+        if wrap and not cached[2]:
+            # Only the last windows run past the end, they are read from a short cyclic copy of the bits (which also
+            # works when the sequence is shorter than the window)
+            if self.n:
+                rolling_codes(self.bits[np.arange(count, self.n + m - 1) % self.n], m, codes[count:])
+            cached[2] = True
+        codes = codes[:] if wrap else codes[:count]
+        codes.flags.writeable = False
+        return codes
+
+    def pattern_histogram(self, m):
+        """
+        The number of times every m-bit pattern occurs in the sequence with its first m - 1 bits appended to the end.
+        A histogram for a longer pattern that is cached already is marginalized instead of counting the windows again:
+        the count of a pattern is the sum over the patterns that extend it.
+        :param m: the pattern length
+        :return: an int64 array of 2^m counts, indexed by pattern (cached, read-only)
+        """
+        longer = [k for k in self._cache if isinstance(k, tuple) and k[0] == 'histogram' and k[1] >= m]
+        if ('histogram', m) not in self._cache and longer:
+            source = self._cache[min(longer)]
+            return self._cached(('histogram', m), lambda: source.reshape(2 ** m, -1).sum(axis=1))
+        return self._cached(('histogram', m), lambda: np.bincount(self.window_codes(m, wrap=True),
+                                                                  minlength=2 ** m).astype(np.int64))
+
+    def blocks(self, block_size):
+        """
+        :param block_size: the number of bits per block
+        :return: a (num_blocks, block_size) view of the bits, the remainder is discarded
+        """
+        num_blocks = self.n // block_size
+        return self.bits[:num_blocks * block_size].reshape(num_blocks, block_size)
@@ -1,5 +1,27 @@
+import struct
 from tqdm import tqdm
-from math import floor
+from math import ceil
+
+class StateTemplate():
+    """
+    The 16 input words of the Salsa20 core for one key and nonce. The constant, key and nonce words are computed
+    once; per block only the two counter words (8 and 9) are patched in.
+    """
+    __slots__ = ('words',)
+
+    def __init__(self, args):
+        """
+        :param args: the 64 input bytes of the core for any counter value
+        """
+        self.words = struct.unpack('<16I', bytes(args))
+
+    def block(self, block):
+        """
+        :param block: the block counter, stored as 8 big-endian bytes like Cipher.littleendian_reverse_16 does
+        :return: the 16 input words of the core for this block counter
+        """
+        return self.words[:8] + struct.unpack('<2I', block.to_bytes(8, 'big')) + self.words[10:]
+
 
 class Cipher():
     sigma0 = [101, 120, 112, 97]
@@ -16,47 +38,49 @@ class Cipher():
         self.k1 = k1
         self.nonce = nonce
         self.count = count
-        pass
+        self.setup()
+
+    def setup(self):
+        """
+        Precomputes the state template for the current key and nonce. Call it again after changing k0, k1 or nonce.
+        """
+        if self.k1 == None:
+            args = self.tau0 + self.k0 + self.tau1 + self.nonce + self.count + self.tau2 + self.k0 + self.tau3
+        else:
+            args = self.sigma0 + self.k0 + self.sigma1 + self.nonce + self.count + self.sigma2 + self.k1 + self.sigma3
+        self.template = StateTemplate(args)
+
+    def to_hex(self, word):
+        return "0x{0:0{1}x}".format(word, 8)
 
     def bsum(self, a, b, mode='int'):
         # Available modes: int, hex
         if mode == 'hex':
-            a = int(a, 16)
-            b = int(b, 16)
-        result = (a+b) % 2**32
-        if mode == 'int':
-            return result
-        else:
-            return "0x{0:0{1}x}".format(result, 8)
+            return self.to_hex((int(a, 16) + int(b, 16)) & 0xffffffff)
+        return (a + b) & 0xffffffff
 
     def bxor(self, a, b, mode='int'):
         # Available modes: int, hex
         if mode == 'hex':
-            a = int(a, 16)
-            b = int(b, 16)
-        result = a ^ b
-        if mode=='int':
-            return result
-        else:
-            return "0x{0:0{1}x}".format(result, 8)
+            return self.to_hex(int(a, 16) ^ int(b, 16))
+        return a ^ b
 
     def l_rot(self, val, bits, mode='int'):
         # Available modes: int, hex
         if mode == 'hex':
-            val = int(val, 16)
-        tmp = bin(val)[2:].zfill(32)
-        result = int(tmp[bits:] + tmp[:bits], 2)
-        if mode == 'int':
-            return result
-        else:
-            return "0x{0:0{1}x}".format(result, 8)
+            return self.to_hex(self.l_rot(int(val, 16), bits))
+        return ((val << bits) | (val >> (32 - bits))) & 0xffffffff
 
     def quarterround(self, *args):
         (y0, y1, y2, y3) = args[0]
-        z1 = self.bxor(y1, self.l_rot(self.bsum(y0, y3), 7))
-        z2 = self.bxor(y2, self.l_rot(self.bsum(z1, y0), 9))
-        z3 = self.bxor(y3, self.l_rot(self.bsum(z2, z1), 13))
-        z0 = self.bxor(y0, self.l_rot(self.bsum(z3, z2), 18))
+        t = (y0 + y3) & 0xffffffff
+        z1 = y1 ^ (((t << 7) | (t >> 25)) & 0xffffffff)
+        t = (z1 + y0) & 0xffffffff
+        z2 = y2 ^ (((t << 9) | (t >> 23)) & 0xffffffff)
+        t = (z2 + z1) & 0xffffffff
+        z3 = y3 ^ (((t << 13) | (t >> 19)) & 0xffffffff)
+        t = (z3 + z2) & 0xffffffff
+        z0 = y0 ^ (((t << 18) | (t >> 14)) & 0xffffffff)
         return [z0, z1, z2, z3]
 
     def rowround(self, *args):
@@ -76,66 +100,157 @@ class Cipher():
         return [y0, y1, y2, y3, y4, y5, y6, y7, y8, y9, y10, y11, y12, y13, y14, y15]
 
     def doubleround(self, *args):
-        # (x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14, x15) =
-        return self.rowround(self.columnround(args[0]))
+        # columnround followed by rowround
+        return self._doublerounds(args[0], 1)
+
+    def _doublerounds(self, x, n):
+        """
+        n doublerounds in a row, unrolled on local integers. doubleround and core both run on this one body.
+        :param x: the 16 input words
+        :param n: the number of doublerounds
+        :return: the 16 output words
+        """
+        (x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14, x15) = x
+        for _ in range(n):
+            t = (x0 + x12) & 0xffffffff
+            x4 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x4 + x0) & 0xffffffff
+            x8 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x8 + x4) & 0xffffffff
+            x12 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x12 + x8) & 0xffffffff
+            x0 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x5 + x1) & 0xffffffff
+            x9 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x9 + x5) & 0xffffffff
+            x13 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x13 + x9) & 0xffffffff
+            x1 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x1 + x13) & 0xffffffff
+            x5 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x10 + x6) & 0xffffffff
+            x14 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x14 + x10) & 0xffffffff
+            x2 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x2 + x14) & 0xffffffff
+            x6 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x6 + x2) & 0xffffffff
+            x10 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x15 + x11) & 0xffffffff
+            x3 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x3 + x15) & 0xffffffff
+            x7 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x7 + x3) & 0xffffffff
+            x11 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x11 + x7) & 0xffffffff
+            x15 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x0 + x3) & 0xffffffff
+            x1 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x1 + x0) & 0xffffffff
+            x2 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x2 + x1) & 0xffffffff
+            x3 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x3 + x2) & 0xffffffff
+            x0 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x5 + x4) & 0xffffffff
+            x6 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x6 + x5) & 0xffffffff
+            x7 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x7 + x6) & 0xffffffff
+            x4 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x4 + x7) & 0xffffffff
+            x5 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x10 + x9) & 0xffffffff
+            x11 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x11 + x10) & 0xffffffff
+            x8 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x8 + x11) & 0xffffffff
+            x9 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x9 + x8) & 0xffffffff
+            x10 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+            t = (x15 + x14) & 0xffffffff
+            x12 ^= ((t << 7) | (t >> 25)) & 0xffffffff
+            t = (x12 + x15) & 0xffffffff
+            x13 ^= ((t << 9) | (t >> 23)) & 0xffffffff
+            t = (x13 + x12) & 0xffffffff
+            x14 ^= ((t << 13) | (t >> 19)) & 0xffffffff
+            t = (x14 + x13) & 0xffffffff
+            x15 ^= ((t << 18) | (t >> 14)) & 0xffffffff
+        return [x0, x1, x2, x3, x4, x5, x6, x7, x8, x9, x10, x11, x12, x13, x14, x15]
 
     def littleendian(self, *args, mode='int'):
         (b0, b1, b2, b3) = args[0]
-        result = b0 + 2**8*b1 + 2**16*b2 + 2**24*b3
+        result = b0 | (b1 << 8) | (b2 << 16) | (b3 << 24)
         if mode=='int':
             return result
         else:
-            return "0x{0:0{1}x}".format(result, 8)
+            return self.to_hex(result)
 
     def littleendian_reverse(self, word, mode='int'):
-        if mode=='int':
-            word = "0x{0:0{1}x}".format(word, 8)
-        b0 = int(word[2:4], 16)
-        b1 = int(word[4:6], 16)
-        b2 = int(word[6:8], 16)
-        b3 = int(word[8:10], 16)
-        return [b0, b1, b2, b3]
+        if mode=='hex':
+            word = int(word, 16)
+        return list(word.to_bytes(4, 'big'))
 
     def littleendian_reverse_16(self, number):
-        string =  "0x{0:0{1}x}".format(number, 16)
-        b = []
-        for s0, s1 in zip(string[0::2], string[1::2]):
-            if s0+s1!='0x':
-                b.append(int(s0+s1, 16))
-            else:
-                continue
-        return b
+        return list(number.to_bytes(max(8, (number.bit_length() + 7) // 8), 'big'))
+
+    def core(self, x):
+        """
+        The Salsa20 core on words: ten doublerounds added to the input.
+        :param x: the 16 input words
+        :return: the 16 output words
+        """
+        return [(a + b) & 0xffffffff for a, b in zip(x, self._doublerounds(x, 10))]
+
+    def iterated_hash(self, *args, times=1, progress=True):
+        """
+        Iterates the Salsa20 hash on its own output. The state stays as integer words between iterations, which is
+        the same as converting the output bytes back with littleendian every time.
+        :param args: the 64 input bytes
+        :param times: the number of iterations
+        :param progress: if this is true a progress bar with the elapsed time and the rate is shown
+        :return: the 64 output bytes of the last iteration
+        """
+        x = struct.unpack('<16I', bytes(args[0]))
+        with tqdm(total=times, disable=not progress, unit='hash') as bar:
+            for done in range(0, times, 10000):
+                step = min(10000, times - done)
+                for _ in range(step):
+                    x = self.core(x)
+                bar.update(step)
+        return list(struct.pack('<16I', *x))
 
     def cipher(self, *args, times=1):
-        for _ in range(times):
-            if _ >= 1:
-                X = little_reverse
-            elif _ == 0:
-                X = args[0]
-            x = []
-            for i in range(16):
-                x.append(self.littleendian(X[4*i:4*i+4]))
-            z = x
-            for _ in range(10):
-                z = self.doubleround(z)
-
-            little_reverse = []
-            for i in range(16):
-                for value in reversed(self.littleendian_reverse(self.bsum(x[i], z[i]))):
-                    little_reverse.append(value)
-        return little_reverse
-
-    def get_cipher(self, times=1):
-        cipher_stream = []
-        if self.k1 == None:
-            for i in tqdm(range(times)):
-                count = self.littleendian_reverse_16(floor(i/64))
-                self.args = self.tau0 + self.k0 + self.tau1 + self.nonce + count + self.tau2 + self.k0 + self.tau3
-                cipher_stream.append(self.cipher(self.args)[i % 64])
-        else:
-            for i in tqdm(range(times)):
-                count = self.littleendian_reverse(floor(i/64))
-                self.args = self.sigma0 + self.k0 + self.sigma1 + self.nonce + count + self.sigma2 + self.k1 + self.sigma3
-                cipher_stream.append(self.cipher(self.args)[i % 64])
+        return self.iterated_hash(args[0], times=times, progress=False)
 
-        return cipher_stream
\ No newline at end of file
+    def get_block(self, block):
+        """
+        Computes the 64-byte keystream block for the given block counter.
+        :param block: the block counter (the index of the block in the keystream)
+        :return: a list of 64 byte values
+        """
+        return list(struct.pack('<16I', *self.core(self.template.block(block))))
+
+    def iter_cipher(self, times=1, batch_size=1):
+        """
+        Generates the keystream block by block. Every 64-byte block is computed once for its counter value and its
+        bytes are served in order, batch_size blocks at a time.
+        :param times: the number of keystream bytes to generate
+        :param batch_size: the number of 64-byte blocks computed per yielded batch
+        :return: a generator of byte lists, the last one cut to the requested length
+        """
+        block = 0
+        while times > 0:
+            batch = []
+            for _ in range(min(batch_size, ceil(times / 64))):
+                batch += self.get_block(block)
+                block += 1
+            batch = batch[:times]
+            times -= len(batch)
+            yield batch
+
+    def get_cipher(self, times=1, batch_size=1):
+        cipher_stream = []
+        for batch in tqdm(self.iter_cipher(times, batch_size), total=ceil(times / (64 * batch_size))):
+            cipher_stream += batch
+        return cipher_stream
@@ -1,14 +1,96 @@
 import math
+from functools import lru_cache
 import scipy.special as spc
-import scipy.fftpack as sff
+import scipy.fft as sfft
 import scipy.stats as sst
-import copy
 import numpy as np
-from BinaryMatrix import BinaryMatrix
+from BinaryMatrix import batch_gf2_rank
+from BitSequence import BitSequence
+
+@lru_cache()
+def rank_piks(q):
+    """
+    The probabilities of full rank, full rank - 1 and lower rank used by the matrix_rank test, computed once per q.
+    """
+    piks = [1.0, 0.0, 0.0]
+    for x in range(1, 50):
+        piks[0] *= 1 - (1.0 / (2 ** x))
+    piks[1] = 2 * piks[0]
+    piks[2] = 1 - piks[0] - piks[1]
+    return piks
+
+@lru_cache()
+def aperiodic_templates(m):
+    """
+    The aperiodic m-bit templates of the non-overlapping template matching test: the templates that cannot overlap
+    a shifted copy of themselves (148 of them for m = 9).
+    """
+    return tuple(format(t, '0{}b'.format(m)) for t in range(2 ** m) if is_aperiodic(t, m))
+
+@lru_cache()
+def overlapping_piks(pattern_size, block_size):
+    """
+    The probabilities of 0, 1, 2, 3, 4 and 5 or more hits per block used by the overlapping_patterns test, computed
+    once per parameter set.
+    """
+    lambda_val = float(block_size - pattern_size + 1) / pow(2, pattern_size)
+    eta = lambda_val / 2.0
+    piks = [NistTest.get_prob(i, eta) for i in range(5)]
+    diff = float(np.array(piks).sum())
+    piks.append(1.0 - diff)
+    return tuple(piks)
+
+@lru_cache()
+def excursion_piks():
+    """
+    The probabilities of 0, 1, 2, 3, 4 and 5 or more visits in a cycle to each of the states -4, -3, -2, -1, 1, 2, 3, 4
+    used by the random_excursions test, computed once.
+    """
+    piks = np.array([[NistTest.get_pik_value(k, x) for k in range(6)] for x in (-4, -3, -2, -1, 1, 2, 3, 4)])
+    piks.flags.writeable = False
+    return piks
+
+def is_aperiodic(code, m):
+    """
+    Whether no proper prefix of the m-bit template code equals the suffix of the same length.
+    """
+    return all((code >> k) != (code & ((1 << (m - k)) - 1)) for k in range(1, m))
+
+def berlekamp_massey(bits):
+    """
+    The Berlekamp Massey Algorithm over GF(2) with the connection polynomials packed into integers, bit j holding the
+    coefficient of x^j. The last bits seen are kept in an integer too, bit j holding the bit j steps back, so the
+    discrepancy is the parity of the AND of the two and every update is a shift and an XOR.
+    :param bits: the sequence as a list of 0/1 ints
+    :return: the length of the shortest LFSR that generates the sequence
+    """
+    c, b = 1, 1
+    l, m = 0, -1
+    window = 0
+    for i, bit in enumerate(bits):
+        window = (window << 1) | bit
+        if bin(c & window).count('1') & 1:
+            temp = c
+            c ^= b << (i - m)
+            if l <= 0.5 * i:
+                l = i + 1 - l
+                m = i
+                b = temp
+    return l
 
 class NistTest():
+    """
+    Every test accepts a binary string or a BitSequence (or anything BitSequence.coerce takes). A BitSequence is also
+    the analysis context of the sequence: the ones count, the random walk, its zero crossings, the window codes and the
+    pattern histograms are computed the first time a test needs them and cached on it, so running the whole battery
+    on one BitSequence computes each of them once. The cache is dropped with clear_cache, or at the end of a with
+    block:
 
-    def monobit(self, bin_data: str):
+        with BitSequence.from_file(path) as sequence:
+            p_values = [test.monobit(sequence), test.serial(sequence), ...]
+    """
+
+    def monobit(self, bin_data):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -18,56 +100,39 @@ class NistTest():
         for a truly random sequence. This test assesses the closeness of the fraction of ones to 1/2, that is the number
         of ones and zeros ina  sequence should be about the same. All subsequent tests depend on this test.
 
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         """
-        count = 0
-        # If the char is 0 minus 1, else add 1
-        for char in bin_data:
-            if char == '0':
-                count -= 1
-            else:
-                count += 1
+        bin_data = BitSequence.coerce(bin_data)
+        # Ones count +1 and zeros count -1
+        count = 2 * bin_data.count_ones() - len(bin_data)
         # Calculate the p value
         sobs = count / math.sqrt(len(bin_data))
         p_val = spc.erfc(math.fabs(sobs) / math.sqrt(2))
         return p_val
 
-    def block_frequency(self, bin_data: str, block_size=128):
+    def block_frequency(self, bin_data, block_size=128):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
         The focus of this tests is the proportion of ones within M-bit blocks. The purpose of this tests is to determine
         whether the frequency of ones in an M-bit block is approximately M/2, as would be expected under an assumption
         of randomness. For block size M=1, this test degenerates to the monobit frequency test.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         :param block_size: the size of the blocks that the binary sequence is partitioned into
         """
+        bin_data = BitSequence.coerce(bin_data)
         # Work out the number of blocks, discard the remainder
         num_blocks = math.floor(len(bin_data) / block_size)
-        block_start, block_end = 0, block_size
-        # Keep track of the proportion of ones per block
-        proportion_sum = 0.0
-        for i in range(num_blocks):
-            # Slice the binary string into a block
-            block_data = bin_data[block_start:block_end]
-            # Keep track of the number of ones
-            ones_count = 0
-            for char in block_data:
-                if char == '1':
-                    ones_count += 1
-            pi = ones_count / block_size
-            proportion_sum += pow(pi - 0.5, 2.0)
-            # Update the slice locations
-            block_start += block_size
-            block_end += block_size
-        # Calculate the p-value
-        chi_squared = 4.0 * block_size * proportion_sum
+        # Keep track of the number of ones per block
+        ones_count = bin_data.blocks(block_size).sum(axis=1, dtype=np.int64)
+        # Calculate the p-value, chi^2 = 4 * M * sum((pi - 0.5)^2) = sum((2 * ones - M)^2) / M summed in integers
+        chi_squared = int(np.sum((2 * ones_count - block_size) ** 2)) / block_size
         p_val = spc.gammaincc(num_blocks / 2, chi_squared / 2)
         return p_val
 
-    def independent_runs(self, bin_data: str):
+    def independent_runs(self, bin_data):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -76,21 +141,18 @@ class NistTest():
         the opposite value. The purpose of the runs tests is to determine whether the number of runs of ones and zeros
         of various lengths is as expected for a random sequence. In particular, this tests determines whether the
         oscillation between zeros and ones is either too fast or too slow.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         """
-        ones_count, n = 0, len(bin_data)
-        for char in bin_data:
-            if char == '1':
-                ones_count += 1
+        bin_data = BitSequence.coerce(bin_data)
+        ones_count, n = bin_data.count_ones(), len(bin_data)
         p, vobs = float(ones_count / n), 1
         tau = 2 / math.sqrt(len(bin_data))
         if abs(p - 0.5) > tau:
             return 0.0
         else:
-            for i in range(1, n):
-                if bin_data[i] != bin_data[i - 1]:
-                    vobs += 1
+            # Every bit that differs from the one before starts a new run
+            vobs += int(np.count_nonzero(np.diff(bin_data.bits)))
             # expected_runs = 1 + 2 * (n - 1) * 0.5 * 0.5
             # print("\t" + "Observed runs =", vobs, "Expected runs", expected_runs)
             num = abs(vobs - 2.0 * n * p * (1.0 - p))
@@ -98,7 +160,7 @@ class NistTest():
             p_val = spc.erfc(float(num / den))
             return p_val
 
-    def longest_runs(self, bin_data: str):
+    def longest_runs(self, bin_data):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -107,9 +169,10 @@ class NistTest():
         longest run of ones that would be expected in a random sequence. Note that an irregularity in the expected
         length of the longest run of ones implies that there is also an irregularity ub tge expected length of the long
         est run of zeroes. Therefore, only one test is necessary for this statistical tests of randomness
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         """
+        bin_data = BitSequence.coerce(bin_data)
         if len(bin_data) < 128:
             print("\t", "Not enough data to run test!")
             return -1.0
@@ -129,30 +192,18 @@ class NistTest():
         # Work out the number of blocks, discard the remainder
         # pik = [0.2148, 0.3672, 0.2305, 0.1875]
         num_blocks = math.floor(len(bin_data) / m)
-        frequencies = np.zeros(k + 1)
-        block_start, block_end = 0, m
-        for i in range(num_blocks):
-            # Slice the binary string into a block
-            block_data = bin_data[block_start:block_end]
-            # Keep track of the number of ones
-            max_run_count, run_count = 0, 0
-            for j in range(0, m):
-                if block_data[j] == '1':
-                    run_count += 1
-                    max_run_count = max(max_run_count, run_count)
-                else:
-                    max_run_count = max(max_run_count, run_count)
-                    run_count = 0
-            max_run_count = max(max_run_count, run_count)
-            if max_run_count < v_values[0]:
-                frequencies[0] += 1
-            for j in range(k):
-                if max_run_count == v_values[j]:
-                    frequencies[j] += 1
-            if max_run_count > v_values[k - 1]:
-                frequencies[k] += 1
-            block_start += m
-            block_end += m
+        # Run-length encode every block at once: with a zero on both sides of each block a run of ones starts where
+        # the bits step up and ends where they step down, in the same block-major order
+        padded = np.zeros((num_blocks, m + 2), dtype=np.int8)
+        padded[:, 1:-1] = bin_data.blocks(m)
+        steps = np.diff(padded, axis=1)
+        run_blocks, run_starts = np.nonzero(steps == 1)
+        run_ends = np.nonzero(steps == -1)[1]
+        max_run_count = np.zeros(num_blocks, dtype=np.int64)
+        np.maximum.at(max_run_count, run_blocks, run_ends - run_starts)
+        # Runs up to v_values[0] go to the first bucket and runs longer than v_values[k - 1] to the last one
+        buckets = np.clip(max_run_count - v_values[0], 0, k)
+        frequencies = np.bincount(buckets, minlength=k + 1).astype(float)
         # print(frequencies)
         chi_squared = 0
         for i in range(len(frequencies)):
@@ -160,51 +211,29 @@ class NistTest():
         p_val = spc.gammaincc(float(k / 2), float(chi_squared / 2))
         return p_val
 
-    def matrix_rank(self, bin_data: str, q=32):
+    def matrix_rank(self, bin_data, q=32):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
         The focus of the test is the rank of disjoint sub-matrices of the entire sequence. The purpose of this test is
         to check for linear dependence among fixed length sub strings of the original sequence. Note that this test
         also appears in the DIEHARD battery of tests.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         """
-        shape = (q, q)
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        block_size = int(q * q)
         num_m = math.floor(n / (q * q))
-        block_start, block_end = 0, block_size
-        # print(q, n, num_m, block_size)
 
         if num_m > 0:
-            max_ranks = [0, 0, 0]
-            for im in range(num_m):
-                block_data = bin_data[block_start:block_end]
-                block = np.zeros(len(block_data))
-                for i in range(len(block_data)):
-                    if block_data[i] == '1':
-                        block[i] = 1.0
-                m = block.reshape(shape)
-                ranker = BinaryMatrix(m, q, q)
-                rank = ranker.compute_rank()
-                # print(rank)
-                if rank == q:
-                    max_ranks[0] += 1
-                elif rank == (q - 1):
-                    max_ranks[1] += 1
-                else:
-                    max_ranks[2] += 1
-                # Update index trackers
-                block_start += block_size
-                block_end += block_size
-
-            piks = [1.0, 0.0, 0.0]
-            for x in range(1, 50):
-                piks[0] *= 1 - (1.0 / (2 ** x))
-            piks[1] = 2 * piks[0]
-            piks[2] = 1 - piks[0] - piks[1]
-
+            # Every q-bit word is a matrix row, num_m matrices of q rows each
+            rows = bin_data.words(q)[:num_m * q].reshape(num_m, q)
+            # Only full rank, full rank - 1 and lower are told apart, so the lower ones are dropped early
+            ranks = batch_gf2_rank(rows, q, floor=q - 1)
+            max_ranks = [np.count_nonzero(ranks == q), np.count_nonzero(ranks == q - 1), 0]
+            max_ranks[2] = num_m - max_ranks[0] - max_ranks[1]
+
+            piks = rank_piks(q)
             chi = 0.0
             for i in range(len(piks)):
                 chi += pow((max_ranks[i] - piks[i] * num_m), 2.0) / (piks[i] * num_m)
@@ -213,7 +242,7 @@ class NistTest():
         else:
             return -1.0
 
-    def spectral(self, bin_data: str):
+    def spectral(self, bin_data, workers=None, segment_size=None):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -221,30 +250,41 @@ class NistTest():
         this test is to detect periodic features (i.e., repetitive patterns that are near each other) in the tested
         sequence that would indicate a deviation from the assumption of randomness. The intention is to detect whether
         the number of peaks exceeding the 95 % threshold is significantly different than 5 %.
-        :param bin_data: a binary string
+        The transform is a real-input FFT of a float32 plus minus one view. scipy.fft keeps the plans it has set up in
+        a cache, so testing the same n again reuses the FFT setup.
+        :param bin_data: a binary string or a BitSequence
+        :param workers: the number of threads the FFT may use, -1 for all cores
+        :param segment_size: opt-in for sequences too large to transform in memory. The sequence is cut into
+        segments of this many bits (the remainder is discarded), each one is transformed on its own and the peak
+        counts and their variances are summed over the segments. This is not the same statistic as one transform of
+        the whole sequence.
         :return: the p-value from the test
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        plus_minus_one = []
-        for char in bin_data:
-            if char == '0':
-                plus_minus_one.append(-1)
-            elif char == '1':
-                plus_minus_one.append(1)
-        # Product discrete fourier transform of plus minus one
-        s = sff.fft(plus_minus_one)
-        modulus = np.abs(s[0:n // 2])
-        tau = np.sqrt(np.log(1 / 0.05) * n)
-        # Theoretical number of peaks
-        count_n0 = 0.95 * (n / 2)
-        # Count the number of actual peaks m > T
-        count_n1 = len(np.where(modulus < tau)[0])
+        if segment_size is None or segment_size >= n:
+            segment_size = n
+        count_n0, count_n1, variance = 0.0, 0, 0.0
+        for start in range(0, n - segment_size + 1, segment_size):
+            # Product discrete fourier transform of plus minus one
+            plus_minus_one = bin_data.unpack(start, start + segment_size).astype(np.float32)
+            plus_minus_one *= 2
+            plus_minus_one -= 1
+            s = sfft.rfft(plus_minus_one, workers=workers)
+            del plus_minus_one
+            modulus = np.abs(s[0:segment_size // 2])
+            tau = np.sqrt(np.log(1 / 0.05) * segment_size)
+            # Theoretical number of peaks
+            count_n0 += 0.95 * (segment_size / 2)
+            # Count the number of actual peaks m > T
+            count_n1 += np.count_nonzero(modulus < tau)
+            variance += segment_size * 0.95 * 0.05 / 4
         # Calculate d and return the p value statistic
-        d = (count_n1 - count_n0) / np.sqrt(n * 0.95 * 0.05 / 4)
+        d = (count_n1 - count_n0) / np.sqrt(variance)
         p_val = spc.erfc(abs(d) / np.sqrt(2))
         return p_val
 
-    def non_overlapping_patterns(self, bin_data: str, pattern="000000001", num_blocks=8):
+    def non_overlapping_patterns(self, bin_data, pattern="000000001", num_blocks=8):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -253,40 +293,84 @@ class NistTest():
         For this test and for the Overlapping Template Matching test of Section 2.8, an m-bit window is used to
         search for a specific m-bit pattern. If the pattern is not found, the window slides one bit position. If the
         pattern is found, the window is reset to the bit after the found pattern, and the search resumes.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :param pattern: the pattern to match to
         :return: the p-value from the test
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
         pattern_size = len(pattern)
         block_size = math.floor(n / num_blocks)
-        pattern_counts = np.zeros(num_blocks)
-        # For each block in the data
-        for i in range(num_blocks):
-            block_start = i * block_size
-            block_end = block_start + block_size
-            block_data = bin_data[block_start:block_end]
-            # Count the number of pattern hits
-            j = 0
-            while j < block_size:
-                sub_block = block_data[j:j + pattern_size]
-                if sub_block == pattern:
-                    pattern_counts[i] += 1
-                    j += pattern_size
-                else:
-                    j += 1
+        block_codes = self.block_window_codes(bin_data, pattern_size, block_size, num_blocks)
+        pattern_counts = self.non_overlapping_counts(block_codes, [int(pattern, 2)], pattern_size)
+        return self.non_overlapping_p_values(pattern_counts, pattern_size, block_size, num_blocks)[0]
+
+    def non_overlapping_templates(self, bin_data, pattern_size=9, num_blocks=8):
+        """
+        Runs the non overlapping template matching test for every aperiodic template of length pattern_size, as NIST
+        SP 800-22 calls for, in a single pass over the sequence: the window codes are computed once and every
+        template's count is read from the per block histogram of the codes.
+        :param bin_data: a binary string or a BitSequence
+        :param pattern_size: the length of the templates
+        :return: the p-values from the test, in the order of aperiodic_templates(pattern_size)
+        """
+        bin_data = BitSequence.coerce(bin_data)
+        block_size = math.floor(len(bin_data) / num_blocks)
+        block_codes = self.block_window_codes(bin_data, pattern_size, block_size, num_blocks)
+        templates = [int(t, 2) for t in aperiodic_templates(pattern_size)]
+        pattern_counts = self.non_overlapping_counts(block_codes, templates, pattern_size)
+        return list(self.non_overlapping_p_values(pattern_counts, pattern_size, block_size, num_blocks))
+
+    def block_window_codes(self, bin_data, pattern_size, block_size, num_blocks):
+        """
+        This method is used by the template matching tests to get the codes of the windows that fit within each block
+        :return: a (num_blocks, block_size - pattern_size + 1) read-only view of the window codes
+        """
+        codes = bin_data.window_codes(pattern_size)
+        width = max(block_size - pattern_size + 1, 0)
+        if num_blocks == 0 or width == 0:
+            return np.zeros((num_blocks, width), dtype=codes.dtype)
+        # Block i starts at window i * block_size, and the windows of the last block end within the sequence
+        return np.lib.stride_tricks.sliding_window_view(codes, width)[::block_size][:num_blocks]
+
+    def non_overlapping_counts(self, block_codes, templates, pattern_size):
+        """
+        This method is used by the non overlapping template matching tests to count the template hits per block. An
+        aperiodic template can not match twice within pattern_size bits, so its count is simply the number of windows
+        with its code; the hits of a periodic template are walked to skip the ones that overlap a counted hit.
+        :return: a (len(templates), num_blocks) array of counts
+        """
+        num_blocks = len(block_codes)
+        pattern_counts = np.zeros((len(templates), num_blocks))
+        for i, block in enumerate(block_codes):
+            pattern_counts[:, i] = np.bincount(block, minlength=1 << pattern_size)[templates]
+        for t, template in enumerate(templates):
+            if not is_aperiodic(template, pattern_size):
+                for i in range(num_blocks):
+                    count, next_start = 0, 0
+                    for j in np.nonzero(block_codes[i] == template)[0]:
+                        if j >= next_start:
+                            count += 1
+                            next_start = j + pattern_size
+                    pattern_counts[t, i] = count
+        return pattern_counts
+
+    def non_overlapping_p_values(self, pattern_counts, pattern_size, block_size, num_blocks):
+        """
+        This method is used by the non overlapping template matching tests to turn the counts into p-values
+        """
         # Calculate the theoretical mean and variance
         mean = (block_size - pattern_size + 1) / pow(2, pattern_size)
         var = block_size * ((1 / pow(2, pattern_size)) - (((2 * pattern_size) - 1) / (pow(2, pattern_size * 2))))
         # Calculate the Chi Squared statistic for these pattern matches
-        chi_squared = 0
+        chi_squared = np.zeros(len(pattern_counts))
         for i in range(num_blocks):
-            chi_squared += pow(pattern_counts[i] - mean, 2.0) / var
+            chi_squared += pow(pattern_counts[:, i] - mean, 2.0) / var
         # Calculate and return the p value statistic
         p_val = spc.gammaincc(num_blocks / 2, chi_squared / 2)
         return p_val
 
-    def overlapping_patterns(self, bin_data: str, pattern_size=9, block_size=1032):
+    def overlapping_patterns(self, bin_data, pattern_size=9, block_size=1032):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -295,52 +379,33 @@ class NistTest():
         window to search for a specific m-bit pattern. As with the test in Section 2.7, if the pattern is not found,
         the window slides one bit position. The difference between this test and the test in Section 2.7 is that
         when the pattern is found, the window slides only one bit before resuming the search.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :param pattern_size: the length of the pattern
         :return: the p-value from the test
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        pattern = ""
-        for i in range(pattern_size):
-            pattern += "1"
         num_blocks = math.floor(n / block_size)
-        lambda_val = float(block_size - pattern_size + 1) / pow(2, pattern_size)
-        eta = lambda_val / 2.0
+        piks = overlapping_piks(pattern_size, block_size)
 
-        piks = [self.get_prob(i, eta) for i in range(5)]
-        diff = float(np.array(piks).sum())
-        piks.append(1.0 - diff)
-
-        pattern_counts = np.zeros(6)
-        for i in range(num_blocks):
-            block_start = i * block_size
-            block_end = block_start + block_size
-            block_data = bin_data[block_start:block_end]
-            # Count the number of pattern hits
-            pattern_count = 0
-            j = 0
-            while j < block_size:
-                sub_block = block_data[j:j + pattern_size]
-                if sub_block == pattern:
-                    pattern_count += 1
-                j += 1
-            if pattern_count <= 4:
-                pattern_counts[pattern_count] += 1
-            else:
-                pattern_counts[5] += 1
+        # Count the hits of the all ones pattern in every block, a hit is a window with every bit set
+        block_codes = self.block_window_codes(bin_data, pattern_size, block_size, num_blocks)
+        hits = (block_codes == (1 << pattern_size) - 1).sum(axis=1)
+        pattern_counts = np.bincount(np.minimum(hits, 5), minlength=6).astype(float)
 
         chi_squared = 0.0
         for i in range(len(pattern_counts)):
             chi_squared += pow(pattern_counts[i] - num_blocks * piks[i], 2.0) / (num_blocks * piks[i])
         return spc.gammaincc(5.0 / 2.0, chi_squared / 2.0)
 
-    def get_prob(self, u, x):
+    @staticmethod
+    def get_prob(u, x):
         out = 1.0 * np.exp(-x)
         if u != 0:
             out = 1.0 * x * np.exp(2 * -x) * (2 ** -u) * spc.hyp1f1(u + 1, 2, x)
         return out
 
-    def universal(self, bin_data: str):
+    def universal(self, bin_data):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -349,9 +414,10 @@ class NistTest():
         significantly compressed without loss of information. A significantly compressible sequence is considered
         to be non-random. **This test is always skipped because the requirements on the lengths of the binary
         strings are too high i.e. there have not been enough trading days to meet the requirements.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the p-value from the test
         """
+        bin_data = BitSequence.coerce(bin_data)
         # The below table is less relevant for us traders and markets than it is for security people
         n = len(bin_data)
         pattern_size = 5
@@ -379,15 +445,6 @@ class NistTest():
             pattern_size = 16
 
         if 5 < pattern_size < 16:
-            # Create the biggest binary string of length pattern_size
-            ones = ""
-            for i in range(pattern_size):
-                ones += "1"
-
-            # How long the state list should be
-            num_ints = int(ones, 2)
-            vobs = np.zeros(num_ints + 1)
-
             # Keeps track of the blocks, and whether were are initializing or summing
             num_blocks = math.floor(n / pattern_size)
             init_bits = 10 * pow(2, pattern_size)
@@ -400,21 +457,16 @@ class NistTest():
                         10.170032, 11.168765, 12.168070, 13.167693, 14.167488, 15.167379]
             sigma = c * math.sqrt(variance[pattern_size] / test_bits)
 
-            cumsum = 0.0
-            for i in range(num_blocks):
-                block_start = i * pattern_size
-                block_end = block_start + pattern_size
-                block_data = bin_data[block_start: block_end]
-                # Work out what state we are in
-                int_rep = int(block_data, 2)
-
-                # Initialize the state list
-                if i < init_bits:
-                    vobs[int_rep] = i + 1
-                else:
-                    initial = vobs[int_rep]
-                    vobs[int_rep] = i + 1
-                    cumsum += math.log(i - initial + 1, 2)
+            # Work out the state of every block, then the (1 based) position of the previous block in the same state
+            # from a stable sort of the blocks by state: in sorted order that block comes right before it
+            int_reps = bin_data.words(pattern_size)[:num_blocks]
+            order = np.argsort(int_reps, kind='stable')
+            same = int_reps[order[1:]] == int_reps[order[:-1]]
+            last_seen = np.zeros(num_blocks, dtype=np.int64)
+            last_seen[order[1:][same]] = order[:-1][same] + 1
+            # Sum the log distances over the test blocks, a state not seen before counts from position 0
+            distances = np.arange(init_bits, num_blocks) + 1 - last_seen[init_bits:]
+            cumsum = float(np.log2(distances).sum())
 
             # Calculate the statistic
             phi = float(cumsum / test_bits)
@@ -431,10 +483,11 @@ class NistTest():
         The focus of this test is the length of a linear feedback shift register (LFSR). The purpose of this test is to
         determine whether or not the sequence is complex enough to be considered random. Random sequences are
         characterized by longer LFSRs. An LFSR that is too short implies non-randomness.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :param block_size: the size of the blocks to divide bin_data into. Recommended block_size >= 500
         :return:
         """
+        bin_data = BitSequence.coerce(bin_data)
         dof = 6
         piks = [0.01047, 0.03125, 0.125, 0.5, 0.25, 0.0625, 0.020833]
 
@@ -443,17 +496,7 @@ class NistTest():
 
         num_blocks = int(len(bin_data) / block_size)
         if num_blocks > 1:
-            block_end = block_size
-            block_start = 0
-            blocks = []
-            for i in range(num_blocks):
-                blocks.append(bin_data[block_start:block_end])
-                block_start += block_size
-                block_end += block_size
-
-            complexities = []
-            for block in blocks:
-                complexities.append(self.berlekamp_massey_algorithm(block))
+            complexities = [berlekamp_massey(block) for block in bin_data.blocks(block_size).tolist()]
 
             t = ([-1.0 * (((-1) ** block_size) * (chunk - mean) + 2.0 / 9) for chunk in complexities])
             vg = np.histogram(t, bins=[-9999999999, -2.5, -1.5, -0.5, 0.5, 1.5, 2.5, 9999999999])[0][::-1]
@@ -475,33 +518,10 @@ class NistTest():
         for a given binary output sequence. The algorithm will also find the minimal polynomial of a linearly recurrent
         sequence in an arbitrary field. The field requirement means that the Berlekamp–Massey algorithm requires all
         non-zero elements to have a multiplicative inverse.
-        :param block_data:
-        :return:
+        :param block_data: a binary string or a BitSequence
+        :return: the linear complexity of block_data
         """
-        n = len(block_data)
-        c = np.zeros(n)
-        b = np.zeros(n)
-        c[0], b[0] = 1, 1
-        l, m, i = 0, -1, 0
-        int_data = [int(el) for el in block_data]
-        while i < n:
-            v = int_data[(i - l):i]
-            v = v[::-1]
-            cc = c[1:l + 1]
-            d = (int_data[i] + np.dot(v, cc)) % 2
-            if d == 1:
-                temp = copy.copy(c)
-                p = np.zeros(n)
-                for j in range(0, l):
-                    if b[j] == 1:
-                        p[j + i - m] = 1
-                c = (c + p) % 2
-                if l <= 0.5 * i:
-                    l = i + 1 - l
-                    m = i
-                    b = temp
-            i += 1
-        return l
+        return berlekamp_massey(BitSequence.coerce(block_data).bits.tolist())
 
     def serial(self, bin_data, pattern_length=16, method="first"):
         """
@@ -512,35 +532,17 @@ class NistTest():
         overlapping patterns is approximately the same as would be expected for a random sequence. Random
         sequences have uniformity; that is, every m-bit pattern has the same chance of appearing as every other
         m-bit pattern. Note that for m = 1, the Serial test is equivalent to the Frequency test of Section 2.1.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :param pattern_length: the length of the pattern (m)
         :return: the P value
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        # Add first m-1 bits to the end
-        bin_data += bin_data[:pattern_length - 1:]
-
-        # Get max length one patterns for m, m-1, m-2
-        max_pattern = ''
-        for i in range(pattern_length + 1):
-            max_pattern += '1'
-
-        # Keep track of each pattern's frequency (how often it appears)
-        vobs_one = np.zeros(int(max_pattern[0:pattern_length:], 2) + 1)
-        vobs_two = np.zeros(int(max_pattern[0:pattern_length-1:], 2) + 1)
-        vobs_thr = np.zeros(int(max_pattern[0:pattern_length-2:], 2) + 1)
-
-        for i in range(n):
-            # Work out what pattern is observed
-            vobs_one[int(bin_data[i:i + pattern_length:], 2)] += 1
-            vobs_two[int(bin_data[i:i + pattern_length-1:], 2)] += 1
-            vobs_thr[int(bin_data[i:i + pattern_length-2:], 2)] += 1
-
-        vobs = [vobs_one, vobs_two, vobs_thr]
+        # Keep track of each pattern's frequency (how often it appears) for m, m-1, m-2
+        vobs = self.pattern_frequencies(bin_data, pattern_length, 3)
         sums = np.zeros(3)
         for i in range(3):
-            for j in range(len(vobs[i])):
-                sums[i] += pow(vobs[i][j], 2)
+            sums[i] = np.dot(vobs[i], vobs[i])
             sums[i] = (sums[i] * pow(2, pattern_length-i)/n) - n
 
         # Calculate the test statistics and p values
@@ -556,50 +558,46 @@ class NistTest():
             # I am not sure if this is correct, but it makes sense to me.
             return min(p_val_one, p_val_two)
 
-    def approximate_entropy(self, bin_data: str, pattern_length=10):
+    def approximate_entropy(self, bin_data, pattern_length=10):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
         As with the Serial test of Section 2.11, the focus of this test is the frequency of all possible overlapping
         m-bit patterns across the entire sequence. The purpose of the test is to compare the frequency of overlapping
         blocks of two consecutive/adjacent lengths (m and m+1) against the expected result for a random sequence.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :param pattern_length: the length of the pattern (m)
         :return: the P value
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        # Add first m+1 bits to the end
-        # NOTE: documentation says m-1 bits but that doesnt make sense, or work.
-        bin_data += bin_data[:pattern_length + 1:]
-
-        # Get max length one patterns for m, m-1, m-2
-        max_pattern = ''
-        for i in range(pattern_length + 2):
-            max_pattern += '1'
-
-        # Keep track of each pattern's frequency (how often it appears)
-        vobs_one = np.zeros(int(max_pattern[0:pattern_length:], 2) + 1)
-        vobs_two = np.zeros(int(max_pattern[0:pattern_length + 1:], 2) + 1)
-
-        for i in range(n):
-            # Work out what pattern is observed
-            vobs_one[int(bin_data[i:i + pattern_length:], 2)] += 1
-            vobs_two[int(bin_data[i:i + pattern_length + 1:], 2)] += 1
+        # Keep track of each pattern's frequency (how often it appears) for m + 1 and m
+        vobs = self.pattern_frequencies(bin_data, pattern_length + 1, 2)[::-1]
 
         # Calculate the test statistics and p values
-        vobs = [vobs_one, vobs_two]
         sums = np.zeros(2)
         for i in range(2):
-            for j in range(len(vobs[i])):
-                if vobs[i][j] > 0:
-                    sums[i] += vobs[i][j] * math.log(vobs[i][j] / n)
+            seen = vobs[i][vobs[i] > 0]
+            sums[i] = np.dot(seen, np.log(seen / n))
         sums /= n
         ape = sums[0] - sums[1]
         chi_squared = 2.0 * n * (math.log(2) - ape)
         p_val = spc.gammaincc(pow(2, pattern_length-1), chi_squared/2.0)
         return p_val
 
-    def cumulative_sums(self, bin_data: str, method="forward"):
+    def pattern_frequencies(self, bin_data, pattern_length, levels):
+        """
+        This method is used by the serial and approximate entropy tests to count the overlapping patterns of the
+        sequence with its first bits appended to the end. The histograms come from BitSequence.pattern_histogram, so
+        the windows are counted once, for the longest length, and the shorter lengths are marginalized from it.
+        :param bin_data: a BitSequence
+        :param pattern_length: the longest pattern length
+        :param levels: how many pattern lengths to count, pattern_length, pattern_length - 1, ...
+        :return: the list of frequency arrays, indexed by pattern, longest pattern first
+        """
+        return [bin_data.pattern_histogram(pattern_length - i).astype(float) for i in range(levels)]
+
+    def cumulative_sums(self, bin_data, method="forward"):
         """
         Note that this description is taken from the NIST documentation [1]
         [1] http://csrc.nist.gov/publications/nistpubs/800-22-rev1a/SP800-22rev1a.pdf
@@ -609,46 +607,48 @@ class NistTest():
         behavior of that cumulative sum for random sequences. This cumulative sum may be considered as a random walk.
         For a random sequence, the excursions of the random walk should be near zero. For certain types of non-random
         sequences, the excursions of this random walk from zero will be large.
-        :param bin_data: a binary string
-        :param method: the method used to calculate the statistic
-        :return: the P-value
+        :param bin_data: a binary string or a BitSequence
+        :param method: the method used to calculate the statistic, "forward", "backward" or "both"
+        :return: the P-value, or the forward and backward P-values when method is "both"
         """
+        bin_data = BitSequence.coerce(bin_data)
         n = len(bin_data)
-        counts = np.zeros(n)
-        # Calculate the statistic using a walk forward
-        if method != "forward":
-            bin_data = bin_data[::-1]
-
-        ix = 0
-        for char in bin_data:
-            sub = 1
-            if char == '0':
-                sub = -1
-            if ix > 0:
-                counts[ix] = counts[ix - 1] + sub
-            else:
-                counts[ix] = sub
-            ix += 1
-
-        # This is the maximum absolute level obtained by the sequence
-        abs_max = np.max(np.abs(counts))
+        counts = bin_data.prefix_sums
+        total = int(counts[-1])
+        # The forward walk visits the levels in counts, the backward walk visits total - x for x in 0 and counts[:-1],
+        # so the extremes of counts[:-1] give the maximum absolute level obtained by both walks
+        low, high = int(counts[:-1].min(initial=0)), int(counts[:-1].max(initial=0))
+        forward_max = max(high, -low, abs(total))
+        backward_max = max(total - low, high - total)
+
+        if method == "both":
+            return [self.cumulative_sums_p_value(n, forward_max), self.cumulative_sums_p_value(n, backward_max)]
+        elif method == "forward":
+            return self.cumulative_sums_p_value(n, forward_max)
+        else:
+            return self.cumulative_sums_p_value(n, backward_max)
 
+    def cumulative_sums_p_value(self, n, abs_max):
+        """
+        This method is used by the cumulative_sums method to get the P-value of a walk of n steps whose maximum absolute
+        level is abs_max. The normal cdf terms of both sums are evaluated in one call.
+        """
         start = int(np.floor(0.25 * np.floor(-n / abs_max) + 1))
         end = int(np.floor(0.25 * np.floor(n / abs_max) - 1))
-        terms_one = []
-        for k in range(start, end + 1):
-            sub = sst.norm.cdf((4 * k - 1) * abs_max / np.sqrt(n))
-            terms_one.append(sst.norm.cdf((4 * k + 1) * abs_max / np.sqrt(n)) - sub)
+        k_one = np.arange(start, end + 1)
 
         start = int(np.floor(0.25 * np.floor(-n / abs_max - 3)))
         end = int(np.floor(0.25 * np.floor(n / abs_max) - 1))
-        terms_two = []
-        for k in range(start, end + 1):
-            sub = sst.norm.cdf((4 * k + 1) * abs_max / np.sqrt(n))
-            terms_two.append(sst.norm.cdf((4 * k + 3) * abs_max / np.sqrt(n)) - sub)
+        k_two = np.arange(start, end + 1)
+
+        cdf = sst.norm.cdf(np.concatenate((4 * k_one - 1, 4 * k_one + 1, 4 * k_two + 1, 4 * k_two + 3)) * abs_max /
+                           np.sqrt(n))
+        cdf_one, cdf_two = cdf[:2 * len(k_one)].reshape(2, -1), cdf[2 * len(k_one):].reshape(2, -1)
+        terms_one = cdf_one[1] - cdf_one[0]
+        terms_two = cdf_two[1] - cdf_two[0]
 
-        p_val = 1.0 - np.sum(np.array(terms_one))
-        p_val += np.sum(np.array(terms_two))
+        p_val = 1.0 - np.sum(terms_one)
+        p_val += np.sum(terms_two)
         return p_val
 
     def random_excursions(self, bin_data):
@@ -662,53 +662,36 @@ class NistTest():
         to a particular state within a cycle deviates from what one would expect for a random sequence. This test is
         actually a series of eight tests (and conclusions), one test and conclusion for each of the states:
         States -> -4, -3, -2, -1 and +1, +2, +3, +4.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the P-value
         """
-        # Turn all the binary digits into +1 or -1
-        int_data = np.zeros(len(bin_data))
-        for i in range(len(bin_data)):
-            if bin_data[i] == '0':
-                int_data[i] = -1.0
-            else:
-                int_data[i] = 1.0
-
-        # Calculate the cumulative sum
-        cumulative_sum = np.cumsum(int_data)
-        # Append a 0 to the end and beginning of the sum
-        cumulative_sum = np.append(cumulative_sum, [0])
-        cumulative_sum = np.append([0], cumulative_sum)
-
-        # These are the states we are going to look at
-        x_values = np.array([-4, -3, -2, -1, 1, 2, 3, 4])
-
-        # Identify all the locations where the cumulative sum revisits 0
-        position = np.where(cumulative_sum == 0)[0]
-        # For this identify all the cycles
-        cycles = []
-        for pos in range(len(position) - 1):
-            # Add this cycle to the list of cycles
-            cycles.append(cumulative_sum[position[pos]:position[pos + 1] + 1])
-        num_cycles = len(cycles)
-
-        state_count = []
-        for cycle in cycles:
-            # Determine the number of times each cycle visits each state
-            state_count.append(([len(np.where(cycle == state)[0]) for state in x_values]))
-        state_count = np.transpose(np.clip(state_count, 0, 5))
-
-        su = []
-        for cycle in range(6):
-            su.append([(sct == cycle).sum() for sct in state_count])
-        su = np.transpose(su)
-
-        piks = ([([self.get_pik_value(uu, state) for uu in range(6)]) for state in x_values])
-        inner_term = num_cycles * np.array(piks)
-        chi = np.sum(1.0 * (np.array(su) - inner_term) ** 2 / inner_term, axis=1)
-        p_values = ([spc.gammaincc(2.5, cs / 2.0) for cs in chi])
+        bin_data = BitSequence.coerce(bin_data)
+        cumulative_sum = bin_data.prefix_sums
+        # With a 0 added to the beginning and end of the walk, a cycle starts at every zero crossing; the last one is
+        # closed by the appended 0 (and has no visits if the walk already ended at 0)
+        zero_crossings = bin_data.zero_crossings
+        num_cycles = len(zero_crossings) + 1
+
+        # The visits to the states we are going to look at, -4, -3, -2, -1, 1, 2, 3, 4, labelled with their state
+        # (0 to 7) and with their cycle: the number of zero crossings before them
+        visits = np.flatnonzero((cumulative_sum >= -4) & (cumulative_sum <= 4) & (cumulative_sum != 0))
+        states = cumulative_sum[visits] + 4
+        states -= states > 4
+        cycles = np.searchsorted(zero_crossings, visits)
+
+        # Determine the number of times each cycle visits each state, then how many cycles visit each state 0, 1, ...,
+        # 4 and 5 or more times
+        state_count = np.bincount(cycles * 8 + states, minlength=num_cycles * 8).reshape(num_cycles, 8)
+        state_count = np.clip(state_count, 0, 5)
+        su = np.bincount((np.arange(8) * 6 + state_count).ravel(), minlength=48).reshape(8, 6)
+
+        inner_term = num_cycles * excursion_piks()
+        chi = np.sum(1.0 * (su - inner_term) ** 2 / inner_term, axis=1)
+        p_values = list(spc.gammaincc(2.5, chi / 2.0))
         return p_values
 
-    def get_pik_value(self, k, x):
+    @staticmethod
+    def get_pik_value(k, x):
         """
         This method is used by the random_excursions method to get expected probabilities
         """
@@ -728,34 +711,17 @@ class NistTest():
         cumulative sum random walk. The purpose of this test is to detect deviations from the expected number of visits
         to various states in the random walk. This test is actually a series of eighteen tests (and conclusions), one
         test and conclusion for each of the states: -9, -8, …, -1 and +1, +2, …, +9.
-        :param bin_data: a binary string
+        :param bin_data: a binary string or a BitSequence
         :return: the P-value
         """
-        int_data = np.zeros(len(bin_data))
-        for i in range(len(bin_data)):
-            int_data[i] = int(bin_data[i])
-        sum_int = (2 * int_data) - np.ones(len(int_data))
-        cumulative_sum = np.cumsum(sum_int)
-
-        li_data = []
-        for xs in sorted(set(cumulative_sum)):
-            if np.abs(xs) <= 9:
-                li_data.append([xs, len(np.where(cumulative_sum == xs)[0])])
-
-        j = self.get_frequency(li_data, 0) + 1
-        p_values = []
-        for xs in range(-9, 9 + 1):
-            if not xs == 0:
-                den = np.sqrt(2 * j * (4 * np.abs(xs) - 2))
-                p_values.append(spc.erfc(np.abs(self.get_frequency(li_data, xs) - j) / den))
-        return p_values
+        bin_data = BitSequence.coerce(bin_data)
+        cumulative_sum = bin_data.prefix_sums
 
-    def get_frequency(self, list_data, trigger):
-        """
-        This method is used by the random_excursions_variant method to get frequencies
-        """
-        frequency = 0
-        for (x, y) in list_data:
-            if x == trigger:
-                frequency = y
-        return frequency
\ No newline at end of file
+        # Count the visits to every state -9 ... 9 in one pass, the states further out all land in the two end bins
+        visits = np.bincount(np.clip(cumulative_sum, -10, 10) + 10, minlength=21)[1:-1]
+
+        j = int(visits[9]) + 1
+        xs = np.array([-9, -8, -7, -6, -5, -4, -3, -2, -1, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        den = np.sqrt(2 * j * (4 * np.abs(xs) - 2))
+        p_values = list(spc.erfc(np.abs(visits[xs + 9] - j) / den))
+        return p_values
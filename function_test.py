@@ -1,5 +1,7 @@
 # Test helper function for Salsa20 cipher
+import sys
 import time
+from Cipher import Cipher
 
 def bsum(a, b, mode='hex'):
     # Available modes: int, hex
@@ -246,18 +248,23 @@ if __name__ == '__main__':
                    86, 16,179,207, 49,237,179, 48, 1,106,178,219,175,199,166, 48,
                    238, 55,204, 36, 31,240, 32, 63, 15, 83, 93,161,116,147, 48,113]))
 
-    # print()
-    # start = time.time()
-    # print([8, 18, 38,199,119, 76,215, 67,173,127,144,162,103,212,176,217,
-    #        192, 19,233, 33,159,197,154,160,128,243,219, 65,171,136,135,225,
-    #        123, 11, 68, 86,237, 82, 20,155,133,189, 9, 83,167,116,194, 78,
-    #        122,127,195,185,185,204,188, 90,245, 9,183,248,226, 85,245,104])
-    # print(salsa20([6,124, 83,146, 38,191, 9, 50, 4,161, 47,222,122,182,223,185,
-    #                75, 27, 0,216, 16,122, 7, 89,162,104,101,147,213, 21, 54, 95,
-    #                225,253,139,176,105,132, 23,116, 76, 41,176,207,221, 34,157,108,
-    #                94, 94, 99, 52, 90,117, 91,220,146,190,239,143,196,176,130,186], times=1000000))
-    # end = time.time()
-    # print(end - start)
+    if '--iterated' in sys.argv:
+        # The million times iterated vector, checked on Cipher.iterated_hash (the hex string salsa20 above would take
+        # hours). This still takes a couple of minutes, so it only runs with --iterated.
+        print()
+        print("Cipher.iterated_hash(times=1000000):")
+        start = time.time()
+        print([8, 18, 38,199,119, 76,215, 67,173,127,144,162,103,212,176,217,
+               192, 19,233, 33,159,197,154,160,128,243,219, 65,171,136,135,225,
+               123, 11, 68, 86,237, 82, 20,155,133,189, 9, 83,167,116,194, 78,
+               122,127,195,185,185,204,188, 90,245, 9,183,248,226, 85,245,104])
+        print(Cipher([0]*16).iterated_hash([6,124, 83,146, 38,191, 9, 50, 4,161, 47,222,122,182,223,185,
+                                            75, 27, 0,216, 16,122, 7, 89,162,104,101,147,213, 21, 54, 95,
+                                            225,253,139,176,105,132, 23,116, 76, 41,176,207,221, 34,157,108,
+                                            94, 94, 99, 52, 90,117, 91,220,146,190,239,143,196,176,130,186],
+                                           times=1000000))
+        end = time.time()
+        print(end - start)
 
     print("#"*80)
     print("Salsa20k0k1(n):")
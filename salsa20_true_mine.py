@@ -15,14 +15,19 @@
     To make your learning and experimentation less cumbersome,
     salsa20.py is free for any use.
 
-    This implementation is intended for Python 2.x.
+    This implementation is intended for Python 3.x.
 
     Larry Bugbee
     May 2009
 
 """
 
+import mmap
+import os
 import struct
+import sys
+from array import array
+from multiprocessing import Pool
 try:
     import psyco
     have_psyco = True
@@ -67,8 +72,8 @@ class Salsa20(object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-    def __init__(self, key, iv='\x00'*8, rounds=ROUNDS):
-        """ Both key and iv are bytestrings.  The key must be exactly
+    def __init__(self, key, iv=b'\x00'*8, rounds=ROUNDS):
+        """ Both key and iv are bytes.  The key must be exactly
             16 or 32 bytes, 128 or 256 bits respectively.  The iv
             must be exactly 8 bytes (64 bits).
 
@@ -166,36 +171,128 @@ class Salsa20(object):
         iv_state[8] = 0
         iv_state[9] = 0
         self.state = iv_state
-        self.lastchunk = 64     # flag to ensure all but the last
-        # chunks is a multiple of 64 bytes
+        self.leftover = b''     # unused keystream of a partly
+        # consumed block, used first by the next chunk
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _set_counter(self, block):
+        """ Position the 64-bit block counter, low word in state[8]
+            and high word in state[9].
+        """
+        self.state[8] = block & 0xffffffff
+        self.state[9] = (block >> 32) & 0xffffffff
+
+    def _get_counter(self):
+        return self.state[8] | (self.state[9] << 32)
+
+    def _increment_counter(self):
+        self.state[8] = (self.state[8] + 1) & 0xffffffff
+        if self.state[8] == 0:               # if overflow in state[8]
+            self.state[9] += 1               # carry to state[9]
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _keystream(self, nblocks):
+        """ The next nblocks*64 bytes of keystream; the counter is
+            advanced past them.
+        """
+        stream = []
+        for i in range(nblocks):
+            stream.append(self._salsa20_scramble())
+            self._increment_counter()
+        return b''.join(stream)
+
+    def keystream(self, offset, length):
+        """ length bytes of keystream starting at byte offset.
+            Neither end needs to be 64-byte aligned.  The position
+            of encrypt() is left untouched.
+        """
+        counter, leftover = self._get_counter(), self.leftover
+        skip = offset % 64
+        self._set_counter(offset // 64)
+        stream = self._keystream((skip + length + 63) // 64)
+        self._set_counter(counter)
+        self.leftover = leftover
+        return stream[skip:skip + length]
+
+    def seek(self, offset):
+        """ Move encrypt() to byte offset of the stream, aligned or
+            not, without generating the keystream before it.
+        """
+        self._set_counter(offset // 64)
+        self.leftover = b''
+        if offset % 64:
+            self.leftover = self._keystream(1)[offset % 64:]
+
+    def tell(self):
+        """ The byte offset encrypt() continues from. """
+        return 64 * self._get_counter() - len(self.leftover)
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def encrypt(self, datain):
-        """ datain and dataout are bytestrings.
+        """ datain is bytes, bytearray or memoryview; dataout is
+            bytes.
 
-            If the data is submitted to this routine in chunks,
-            the chunk size MUST be an exact multiple of 64 bytes.
-            Only the final chunk may be less than an even multiple.
+            The data may be submitted to this routine in chunks of
+            any size; each chunk continues where the last one, or
+            the last seek(), left off.
         """
-        if self.lastchunk != 64:
-            raise Exception('size of last chunk not a multiple of 64 bytes')
-        dataout = ''
-        stream  = ''
-        while datain:
-            stream = self._salsa20_scramble();
-            self.state[8] += 1
-            if self.state[8] == 0:               # if overflow in state[8]
-                self.state[9] += 1               # carry to state[9]
-                # not to exceed 2^70 x 2^64 = 2^134 data size ??? <<<<
-            dataout += self._xor(stream, datain[:64])
-            if len(datain) <= 64:
-                self.lastchunk = len(datain)
-                return dataout
-            datain = datain[64:]
-        raise Exception('Huh?')
+        dataout = bytearray(len(datain))
+        self.encrypt_into(datain, dataout)
+        return bytes(dataout)
     decrypt = encrypt
 
+    def encrypt_into(self, src, dst, chunk_blocks=1024):
+        """ XOR src with the keystream into the preallocated buffer
+            dst, which must hold at least len(src) bytes.  Both are
+            bytes-like objects; src may be dst for in-place work.
+            Keystream is generated chunk_blocks blocks at a time.
+
+            Returns the number of bytes written.
+        """
+        src = memoryview(src).cast('B')
+        dst = memoryview(dst).cast('B')
+        n = len(src)
+        if len(dst) < n:
+            raise Exception('dst must hold at least len(src) bytes')
+        i = min(n, len(self.leftover))
+        if i:
+            dst[:i] = self._xor(self.leftover, src[:i])
+            self.leftover = self.leftover[i:]
+        step = 64 * chunk_blocks
+        while i < n:
+            din = src[i:i + step]
+            stream = self._keystream((len(din) + 63) // 64)
+            dst[i:i + len(din)] = self._xor(stream, din)
+            self.leftover = stream[len(din):]
+            i += len(din)
+        return n
+    decrypt_into = encrypt_into
+
+    def encrypt_file(self, src_path, dst_path, chunk_size=1 << 20):
+        """ Stream the file at src_path through the cipher into
+            dst_path, chunk_size bytes at a time, reusing two
+            preallocated buffers.
+        """
+        buf = bytearray(chunk_size)
+        out = bytearray(chunk_size)
+        view = memoryview(buf)
+        with open(src_path, 'rb') as fin, open(dst_path, 'wb') as fout:
+            while True:
+                n = 0
+                while n < chunk_size:        # fill whole chunks
+                    got = fin.readinto(view[n:])
+                    if not got:
+                        break
+                    n += got
+                if not n:
+                    break
+                self.encrypt_into(view[:n], out)
+                fout.write(memoryview(out)[:n])
+    decrypt_file = encrypt_file
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def _ROL32(self, a,b):
@@ -283,10 +380,9 @@ class Salsa20(object):
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def _xor(self, stream, din):
-        dout = []
-        for i in range(len(din)):
-            dout.append(chr(ord(stream[i])^ord(din[i])))
-        return ''.join(dout)
+        n = len(din)
+        return (int.from_bytes(stream[:n], 'little') ^
+                int.from_bytes(din, 'little')).to_bytes(n, 'little')
 
     if have_psyco:
         #        _key_setup = psyco.proxy(_key_setup)   # doesn't have much effect
@@ -295,27 +391,186 @@ class Salsa20(object):
         _salsa20_scramble = psyco.proxy(_salsa20_scramble)  # big help, 2x
         _xor = psyco.proxy(_xor)                # very small impact
 
+#-----------------------------------------------------------------------
+
+def _keystream_range(args):
+    """ Worker for parallel_keystream: the keystream for the block
+        counters start .. start+count-1, as one bytestring.
+    """
+    key, iv, rounds, start, count = args
+    s20 = Salsa20(key, iv, rounds)
+    s20._set_counter(start)
+    stream = []
+    for i in range(count):
+        stream.append(s20._salsa20_scramble())
+        s20._increment_counter()
+    return b''.join(stream)
+
+def parallel_keystream(key, iv, how_many, rounds=Salsa20.ROUNDS,
+                       workers=None, chunk_blocks=None, start=0):
+    """ Generate how_many 64-byte blocks from block counter start on
+        a pool of worker processes.
+
+        The counter space is split into contiguous ranges, by default
+        one per worker, or of chunk_blocks blocks each to bound the
+        memory held at once.  Chunks are yielded in counter order, so
+        their concatenation is byte-identical to the serial run no
+        matter how many workers there are.
+    """
+    if how_many <= 0:
+        return
+    workers = workers or os.cpu_count()
+    size = max(1, chunk_blocks or -(-how_many // workers))
+    end = start + how_many
+    ranges = [(key, iv, rounds, s, min(size, end - s))
+              for s in range(start, end, size)]
+    with Pool(workers) as pool:
+        for chunk in pool.imap(_keystream_range, ranges):
+            yield chunk
+
+#-----------------------------------------------------------------------
+
+def decrypt_range(path, key, iv, offset, length, rounds=Salsa20.ROUNDS,
+                  cipher=Salsa20):
+    """ Decrypt length bytes from byte offset of the encrypted file
+        at path.  The file is memory-mapped and the cipher seeks to
+        offset, so nothing before the range is read or generated.
+        cipher may be any Salsa20 subclass, e.g. Salsa20Vector.
+    """
+    size = os.path.getsize(path)
+    length = max(0, min(length, size - offset))
+    dataout = bytearray(length)
+    if length:
+        s20 = cipher(key, iv, rounds)
+        s20.seek(offset)
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                memoryview(mm) as view:
+            s20.decrypt_into(view[offset:offset + length], dataout)
+    return bytes(dataout)
+
+def _decrypt_range(args):
+    return decrypt_range(*args)
+
+def decrypt_file_parallel(src_path, dst_path, key, iv, rounds=Salsa20.ROUNDS,
+                          workers=None, chunk_size=None, cipher=Salsa20):
+    """ Decrypt the file at src_path into dst_path on a pool of
+        worker processes, each decrypting its own byte range with
+        decrypt_range.  Ranges are one per worker by default, or
+        chunk_size bytes each to bound the memory held at once, and
+        are written out in file order.
+    """
+    size = os.path.getsize(src_path)
+    workers = workers or os.cpu_count()
+    step = max(1, chunk_size or 64 * max(1, -(-size // (64 * workers))))
+    ranges = [(src_path, key, iv, start, step, rounds, cipher)
+              for start in range(0, size, step)]
+    with open(dst_path, 'wb') as fout, Pool(workers) as pool:
+        for chunk in pool.imap(_decrypt_range, ranges):
+            fout.write(chunk)
+encrypt_file_parallel = decrypt_file_parallel
+
+#-----------------------------------------------------------------------
+
+class KeystreamWriter(object):
+    """
+        Bulk writer for generated keystream files.  Chunks of
+        keystream bytes are formatted as a whole and copied into a
+        preallocated buffer that is written out in large pieces.
+
+        Output formats:
+
+         'bin'   raw keystream bytes, 32-bit words little-endian
+                 exactly as _salsa20_scramble produces them
+         'bits'  packed bits, each 32-bit word most significant bit
+                 first, so the bit stream of the file reads as the
+                 binary representations of the words
+         'text'  DIEHARD-style decimal text, a 'type: d / count /
+                 numbit: 32' header followed by one word per line
+
+        Sample usage:
+
+         with KeystreamWriter('stream.bin', 'bin') as out:
+             for chunk in parallel_keystream(key, iv, how_many):
+                 out.write(chunk)
+    """
+
+    FORMATS = ('bin', 'bits', 'text')
+
+    def __init__(self, path, fmt='bin', count=None, buffer_size=1 << 22):
+        """ count is the number of 32-bit words to be written and is
+            only used for the header of the 'text' format.
+        """
+        if fmt not in self.FORMATS:
+            raise Exception('format must be one of %s' % ', '.join(self.FORMATS))
+        self.fmt = fmt
+        self.f = open(path, 'wb')
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.fill = 0
+        if fmt == 'text':
+            self.write_raw(('type: d\ncount: {}\nnumbit: 32\n'.format(count)).encode('ascii'))
+
+    def _format(self, chunk):
+        if self.fmt == 'bin':
+            return chunk
+        words = array('I', chunk)
+        if self.fmt == 'bits':
+            words.byteswap()                 # to big-endian words
+            return words.tobytes()
+        if sys.byteorder == 'big':
+            words.byteswap()                 # to native word values
+        return ('\n'.join(map(str, words)) + '\n').encode('ascii')
+
+    def write(self, chunk):
+        """ chunk is a bytestring of whole 32-bit words. """
+        self.write_raw(self._format(chunk))
+
+    def write_raw(self, data):
+        if self.fill + len(data) > len(self.buffer):
+            self.flush()
+        if len(data) >= len(self.buffer):
+            self.f.write(data)
+        else:
+            self.view[self.fill:self.fill + len(data)] = data
+            self.fill += len(data)
+
+    def flush(self):
+        self.f.write(self.view[:self.fill])
+        self.fill = 0
+
+    def close(self):
+        self.flush()
+        self.view.release()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 #-----------------------------------------------------------------------
 #-----------------------------------------------------------------------
 
 def test():
 
     def strnumlist(L):
-        return ''.join([chr(x) for x in L])
+        return bytes(L)
 
     def printlong(label, bs, bpl, dent):
         tmpl = '%-' + str(dent) + 's'
         while bs:
-            print (tmpl % label)[:dent], bs[:bpl].encode('hex')
+            print((tmpl % label)[:dent], bs[:bpl].hex())
             label = ''
             bs = bs[bpl:]
 
 
     if 0:
         print('-'*40)
-        key    = 'qwerty7890123456'
-        iv     = 'iv345678'
-        data   = 'Kilroy'
+        key    = b'qwerty7890123456'
+        iv     = b'iv345678'
+        data   = b'Kilroy'
 
         s20 = Salsa20(key, iv)
         ciphertext = s20.encrypt(data)
@@ -340,9 +595,9 @@ def test():
                            8C6713EC66C51881111593CCB3E8CB8F
                            8DE124080501EEEB389C4BCB6977CF95
         '''
-        key  = ('80000000000000000000000000000000').decode('hex')
-        iv   = ('0000000000000000').decode('hex')
-        data = ('00'*256).decode('hex')      # 512
+        key  = bytes.fromhex('80000000000000000000000000000000')
+        iv   = bytes.fromhex('0000000000000000')
+        data = bytes.fromhex('00'*256)      # 512
 
         ciphertext = Salsa20(key, iv).encrypt(data)
 
@@ -366,9 +621,9 @@ def test():
                            8C6713EC66C51881111593CCB3E8CB8F
                            8DE124080501EEEB389C4BCB6977CF95
         '''
-        key  = ('80000000000000000000000000000000').decode('hex')
-        iv   = ('0000000000000000').decode('hex')
-        data = ('00'*256).decode('hex')      # 512
+        key  = bytes.fromhex('80000000000000000000000000000000')
+        iv   = bytes.fromhex('0000000000000000')
+        data = bytes.fromhex('00'*256)      # 512
 
         s20 = Salsa20(key, iv)
         ciphertext  = s20.encrypt(data[:128])
@@ -407,11 +662,10 @@ def test():
                            3DB3E8D7065AF375A225A70951C8AB74
                            4EC4D595E85225F08E2BC03FE1C42567
         '''
-        key  = ('80000000000000000000000000000000' +
-                '00000000000000000000000000000000'
-                ).decode('hex')
-        iv   = ('0000000000000000').decode('hex')
-        data = ('00'*64).decode('hex')      # 512
+        key  = bytes.fromhex('80000000000000000000000000000000' +
+                             '00000000000000000000000000000000')
+        iv   = bytes.fromhex('0000000000000000')
+        data = bytes.fromhex('00'*64)      # 512
 
         ciphertext = Salsa20(key, iv).encrypt(data)
 
@@ -426,12 +680,11 @@ def test():
         print('timing test')
         import time
 
-        key  = ('80000000000000000000000000000000' +
-                '00000000000000000000000000000000'
-                ).decode('hex')
-        iv   = ('0000000000000000').decode('hex')
+        key  = bytes.fromhex('80000000000000000000000000000000' +
+                             '00000000000000000000000000000000')
+        iv   = bytes.fromhex('0000000000000000')
         datalen = 1024
-        data = ('00'*datalen).decode('hex')
+        data = bytes.fromhex('00'*datalen)
         iter = 100
 
         t0 = time.time()
@@ -455,22 +708,20 @@ def test():
 
 if __name__ == '__main__':
     # test()
-    key    = 'qwerty7890123456'
-    iv     = 'iv345678'
+    key    = b'qwerty7890123456'
+    iv     = b'iv345678'
     data   = 'Kilroy'
-    s20 = Salsa20(key, iv)
     from tqdm import tqdm
     how_many = 1000000
-    with open('genetika_5.txt', 'w') as f:
-        f.write('type: d\n')
-        f.write('count: {}\n'.format(how_many*16))
-        f.write('numbit: 32\n')
-        for i in tqdm(range(how_many)):
-            for cip in struct.unpack('<16I',s20._salsa20_scramble()):
-                f.write(str(cip)+'\n')
-            s20.state[8] += 1
-            if s20.state[8] == 0:               # if overflow in state[8]
-                s20.state[9] += 1
+    workers  = os.cpu_count()
+    chunk_blocks = 16384
+    output_format = 'text'           # 'bin', 'bits' or 'text'
+    output_file = 'genetika_5.txt' if output_format == 'text' else 'genetika_5.bin'
+    with KeystreamWriter(output_file, output_format, count=how_many*16) as out:
+        for chunk in tqdm(parallel_keystream(key, iv, how_many, workers=workers,
+                                             chunk_blocks=chunk_blocks),
+                          total=-(-how_many // chunk_blocks)):
+            out.write(chunk)
 
 #-----------------------------------------------------------------------
 #-----------------------------------------------------------------------
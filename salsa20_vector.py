@@ -0,0 +1,168 @@
+"""
+    A NumPy engine for the Salsa20 variant in salsa20_true_mine.
+
+    The 16-word state is held as a (16, N) uint32 array, one column
+    per block counter, and the quarterround/columnround/rowround
+    structure of Salsa20._salsa20_scramble runs as whole-array
+    add/xor/rotate operations.  One call produces N*64 keystream
+    bytes, bit-exact with N calls of Salsa20._salsa20_scramble.
+
+    Sample usage:
+
+     s20 = Salsa20Vector(key, iv, 20)
+     stream = s20.keystream_blocks(0, 4096)     # 256 KB
+
+    batch_keystream does the same for many keys, ivs and starting
+    counters at once:
+
+     streams = batch_keystream(keys, ivs, counters, nblocks=16)
+"""
+
+import numpy as np
+from salsa20_true_mine import Salsa20
+
+#-----------------------------------------------------------------------
+
+def _ROL32(a, b):
+    return (a << np.uint32(b)) | (a >> np.uint32(32 - b))
+
+def quarterround(x0, x1, x2, x3):
+    """ Salsa20.quarterround on uint32 arrays; uint32 addition
+        wraps modulo 2^32 on its own.
+    """
+    x1 = x1 + x2
+    x1 = x1 + x3
+    x0 = _ROL32(x0, 7)
+    x0 = x0 ^ x3
+    x3 = x3 ^ x1
+    x0 = x0 ^ x3
+    x1 = x1 + x2
+    x1 = _ROL32(x1, 6)
+    x3 = _ROL32(x3, 16)
+    x1 = x1 + x3
+    x1 = _ROL32(x1, 13)
+    x1 = _ROL32(x1, 10)
+    return x0, x1, x2, x3
+
+def salsa20_scramble(state, rounds=Salsa20.ROUNDS):
+    """ state is a (16, N) uint32 array, one column per block.
+
+        Returns the scrambled state added to the input, as a
+        (16, N) uint32 array.
+    """
+    x = list(state)
+    for i in range(rounds, 0, -2):
+        # columnround
+        x[0], x[4], x[8], x[12] = quarterround(x[0], x[4], x[8], x[12])
+        x[5], x[9], x[13], x[1] = quarterround(x[5], x[9], x[13], x[1])
+        x[10], x[14], x[2], x[6] = quarterround(x[10], x[14], x[2], x[6])
+        x[15], x[3], x[7], x[11] = quarterround(x[15], x[3], x[7], x[11])
+        # rowround
+        x[0], x[1], x[2], x[3] = quarterround(x[0], x[1], x[2], x[3])
+        x[5], x[6], x[7], x[4] = quarterround(x[5], x[6], x[7], x[4])
+        x[10], x[11], x[8], x[9] = quarterround(x[10], x[11], x[8], x[9])
+        x[15], x[12], x[13], x[14] = quarterround(x[15], x[12], x[13], x[14])
+    return np.stack(x) + state
+
+def to_bytes(words):
+    """ (16, N) uint32 words to N*64 keystream bytes, block after
+        block, each word little-endian like struct.pack('<16I').
+    """
+    return np.ascontiguousarray(words.T).astype('<u4', copy=False).tobytes()
+
+def _as_rows(data, width=None):
+    """ A list of bytestrings or a 2-D array-like as a (S, width)
+        uint8 array.
+    """
+    if isinstance(data, (list, tuple)) and data and isinstance(data[0], (bytes, bytearray)):
+        data = np.frombuffer(b''.join(data), dtype=np.uint8).reshape(len(data), -1)
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    return data if width is None else data.reshape(-1, width)
+
+def batch_keystream(keys, ivs, counters=0, nblocks=1, rounds=Salsa20.ROUNDS):
+    """ Keystreams for many (key, iv, counter) streams at once.
+
+        keys is a list of S bytestrings or an (S, 16) or (S, 32)
+        uint8 array, all of one length; ivs likewise with 8 bytes
+        per stream; counters the starting block counter of each
+        stream, or one counter for all.  All S*nblocks blocks go
+        through a single salsa20_scramble call.
+
+        Returns an (S, nblocks*64) uint8 array whose row s is the
+        keystream Salsa20(keys[s], ivs[s], rounds) produces from
+        block counters[s] on.
+    """
+    if rounds not in [20, 12, 8]:
+        raise Exception('number of rounds must be 8, 12, or 20')
+    keys = _as_rows(keys)
+    if keys.shape[1] not in [16, 32]:
+        raise Exception('key must be either 16 or 32 bytes')
+    ivs = _as_rows(ivs, 8)
+    num = len(keys)
+    k = keys.view('<u4')
+    v = ivs.view('<u4')
+    const = Salsa20.TAU if keys.shape[1] == 16 else Salsa20.SIGMA
+
+    state = np.empty((16, num, nblocks), dtype=np.uint32)
+    state[0], state[5], state[10], state[15] = const
+    state[1:5] = k[:, :4].T[:, :, None]
+    state[11:15] = k[:, -4:].T[:, :, None]
+    state[6:8] = v.T[:, :, None]
+    counter = (np.broadcast_to(np.asarray(counters, dtype=np.uint64), (num,))[:, None] +
+               np.arange(nblocks, dtype=np.uint64))
+    state[8] = counter & np.uint64(0xffffffff)
+    state[9] = counter >> np.uint64(32)
+
+    words = salsa20_scramble(state.reshape(16, -1), rounds).reshape(16, num, nblocks)
+    words = np.ascontiguousarray(words.transpose(1, 2, 0)).astype('<u4', copy=False)
+    return words.view(np.uint8).reshape(num, nblocks * 64)
+
+#-----------------------------------------------------------------------
+
+class Salsa20Vector(Salsa20):
+    """
+        Salsa20 with a vectorized multi-block keystream.  Key and iv
+        setup are inherited from Salsa20; the keystream for a run of
+        block counters is computed in one pass of salsa20_scramble.
+    """
+
+    def __init__(self, key, iv=b'\x00'*8, rounds=Salsa20.ROUNDS):
+        Salsa20.__init__(self, key, iv, rounds)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _counter_state(self, start, n):
+        """ The (16, n) state for block counters start .. start+n-1,
+            counter low word in row 8 and high word in row 9.
+        """
+        state = np.empty((16, n), dtype=np.uint32)
+        state[:] = np.array(self.state, dtype=np.uint64)[:, None]
+        counter = np.arange(start, start + n, dtype=np.uint64)
+        state[8] = counter & np.uint64(0xffffffff)
+        state[9] = counter >> np.uint64(32)
+        return state
+
+    def keystream_blocks(self, start, n):
+        """ n*64 keystream bytes starting at block counter start.
+            Does not touch the counter in self.state.
+        """
+        return to_bytes(salsa20_scramble(self._counter_state(start, n), self.ROUNDS))
+
+    def scramble_blocks(self, n):
+        """ The next n blocks from the counter in self.state[8:10],
+            which is then advanced by n, just like n calls of
+            _salsa20_scramble followed by counter increments.
+        """
+        start = self.state[8] | (self.state[9] << 32)
+        stream = self.keystream_blocks(start, n)
+        start += n
+        self.state[8] = start & 0xffffffff
+        self.state[9] = start >> 32
+        return stream
+
+    def _keystream(self, nblocks):
+        # the encrypt/encrypt_into/encrypt_file paths of Salsa20
+        # draw their keystream through here
+        return self.scramble_blocks(nblocks)
+
+#-----------------------------------------------------------------------